@@ -3,19 +3,119 @@ Database Module - SQLite
 Quản lý lưu trữ thông tin phát hiện người
 """
 import sqlite3
+import json
 from datetime import datetime
+from collections import deque
+import threading
+import time
 import os
 
 
+DATETIME_FORMAT = "%d/%m/%Y %H:%M:%S"
+
+# Columns returned by iter_detections / get_detection_page
+DETECTION_FIELDS = ('id', 'ts', 'datetime', 'person_count', 'confidence', 'image_path', 'phash', 'duplicate_of')
+
+# Event types in the events table (gate events come from GateController)
+EVENT_DETECTION = "DETECTION"
+EVENT_FIELDS = ('id', 'ts', 'event_type', 'source', 'detection_id', 'data')
+
+
+class DetectionCache:
+    """
+    Write-through cache trong RAM cho N ban ghi gan nhat + thong ke
+    
+    Detection loop la noi ghi duy nhat, nen cache duoc cap nhat ngay
+    trong add_detection va doc khong can cham vao SQLite.
+    """
+    
+    def __init__(self, max_size=100):
+        """Initialize empty cache (chua warm)"""
+        self.max_size = max_size
+        self.rows = deque(maxlen=max_size)  # Newest first
+        self.total = 0
+        self.sum_confidence = 0.0
+        self.max_people = 0
+        self.warm = False
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+    
+    def load(self, rows, total, sum_confidence, max_people):
+        """Nap du lieu tu database (rows: moi nhat truoc)"""
+        with self.lock:
+            self.rows.clear()
+            self.rows.extend(rows)
+            self.total = total
+            self.sum_confidence = sum_confidence or 0.0
+            self.max_people = max_people or 0
+            self.warm = True
+    
+    def push(self, row, person_count, confidence):
+        """Them ban ghi moi vao dau cache va cap nhat thong ke"""
+        with self.lock:
+            if not self.warm:
+                return
+            self.rows.appendleft(row)
+            self.total += 1
+            self.sum_confidence += confidence
+            self.max_people = max(self.max_people, person_count)
+    
+    def invalidate(self):
+        """Xoa cache - lan doc tiep theo se nap lai tu database"""
+        with self.lock:
+            self.rows.clear()
+            self.warm = False
+    
+    def get_recent(self, limit):
+        """Lay N ban ghi gan nhat, None neu cache khong du (limit < 0 = tat ca -> SQL)"""
+        with self.lock:
+            if not self.warm or limit < 0 or limit > self.max_size:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return list(self.rows)[:limit]
+    
+    def get_stats(self):
+        """Lay thong ke, None neu cache chua warm"""
+        with self.lock:
+            if not self.warm:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return {
+                'total_detections': self.total,
+                'avg_confidence': self.sum_confidence / self.total if self.total else 0,
+                'max_people': self.max_people
+            }
+    
+    def get_counters(self):
+        """Lay hit/miss counters"""
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / requests, 3) if requests else 0,
+                'size': len(self.rows),
+                'max_size': self.max_size,
+                'warm': self.warm
+            }
+
+
 class DetectionDatabase:
-    def __init__(self, db_path=None):
+    def __init__(self, db_path=None, cache_size=100):
         """Khởi tạo database"""
         # Use absolute path for database
         if db_path is None:
             db_path = os.path.join(os.path.dirname(__file__), '..', 'database', 'detections.db')
         self.db_path = os.path.abspath(db_path)
         self.conn = None
+        self.write_lock = threading.Lock()  # Detection loop + Flask threads both write
+        self.clear_listeners = []           # Callbacks run after clear_all()
+        self.cache = DetectionCache(cache_size)
         self.create_database()
+        self._warm_cache()
     
     def create_database(self):
         """Tạo database và bảng nếu chưa tồn tại"""
@@ -33,10 +133,77 @@ class DetectionDatabase:
             )
         ''')
         
+        # Migrate old databases: perceptual hash + link to duplicate snapshot
+        self._add_column_if_missing(cursor, 'phash', 'TEXT')
+        self._add_column_if_missing(cursor, 'duplicate_of', 'INTEGER')
+        
+        # Epoch timestamp (sortable) - datetime TEXT is dd/mm/YYYY and cannot be range-filtered
+        self._add_column_if_missing(cursor, 'ts', 'REAL')
+        self._backfill_timestamps(cursor)
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_detections_ts ON detections(ts)')
+        
+        # Bảng events: detection + gate transitions + manual overrides, cùng epoch ts
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'events'")
+        events_exists = cursor.fetchone() is not None
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                ts REAL NOT NULL,
+                event_type TEXT NOT NULL,
+                source TEXT DEFAULT 'python',
+                detection_id INTEGER,
+                data TEXT
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_events_type_ts ON events(event_type, ts)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_events_ts ON events(ts)')
+        if not events_exists:
+            # First run: import existing detections as events
+            cursor.execute('''
+                INSERT INTO events (ts, event_type, detection_id)
+                SELECT ts, ?, id FROM detections WHERE ts IS NOT NULL ORDER BY id
+            ''', (EVENT_DETECTION,))
+        
         self.conn.commit()
         print(f"[DB] Database đã sẵn sàng: {self.db_path}")
     
-    def add_detection(self, person_count, confidence, image_path=None):
+    def _add_column_if_missing(self, cursor, column, column_type):
+        """Them cot vao bang detections neu chua co (migration)"""
+        cursor.execute('PRAGMA table_info(detections)')
+        columns = [row[1] for row in cursor.fetchall()]
+        if column not in columns:
+            cursor.execute(f'ALTER TABLE detections ADD COLUMN {column} {column_type}')
+            print(f"[DB] Da them cot: {column}")
+    
+    def _backfill_timestamps(self, cursor):
+        """Tinh ts (epoch) tu cot datetime cho cac ban ghi cu"""
+        cursor.execute('SELECT id, datetime FROM detections WHERE ts IS NULL')
+        updates = []
+        for detection_id, text in cursor.fetchall():
+            try:
+                updates.append((datetime.strptime(text, DATETIME_FORMAT).timestamp(), detection_id))
+            except (TypeError, ValueError):
+                continue
+        if updates:
+            cursor.executemany('UPDATE detections SET ts = ? WHERE id = ?', updates)
+            print(f"[DB] Da cap nhat ts cho {len(updates)} ban ghi")
+    
+    def _warm_cache(self):
+        """Nap N ban ghi gan nhat va thong ke vao cache"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT person_count, datetime, confidence, image_path
+            FROM detections
+            ORDER BY id DESC
+            LIMIT ?
+        ''', (self.cache.max_size,))
+        rows = cursor.fetchall()
+        
+        cursor.execute('SELECT COUNT(*), SUM(confidence), MAX(person_count) FROM detections')
+        total, sum_conf, max_people = cursor.fetchone()
+        self.cache.load(rows, total, sum_conf, max_people)
+    
+    def add_detection(self, person_count, confidence, image_path=None, phash=None, duplicate_of=None):
         """
         Thêm một bản ghi phát hiện mới
         
@@ -44,23 +211,134 @@ class DetectionDatabase:
             person_count (int): Số người phát hiện được
             confidence (float): Độ tin cậy
             image_path (str): Đường dẫn ảnh (optional)
+            phash (str): Perceptual hash dạng hex (optional)
+            duplicate_of (int): ID bản ghi có ảnh gần trùng lặp (optional)
         
         Returns:
             int: ID của bản ghi vừa thêm
         """
-        cursor = self.conn.cursor()
-        now = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
+        ts = time.time()
+        now = datetime.fromtimestamp(ts).strftime(DATETIME_FORMAT)
         
-        cursor.execute('''
-            INSERT INTO detections (person_count, datetime, confidence, image_path)
-            VALUES (?, ?, ?, ?)
-        ''', (person_count, now, confidence, image_path))
+        with self.write_lock:
+            cursor = self.conn.cursor()
+            cursor.execute('''
+                INSERT INTO detections (person_count, datetime, ts, confidence, image_path, phash, duplicate_of)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (person_count, now, ts, confidence, image_path, phash, duplicate_of))
+            detection_id = cursor.lastrowid
+            
+            # Same transaction: detection row + DETECTION event
+            cursor.execute('''
+                INSERT INTO events (ts, event_type, detection_id)
+                VALUES (?, ?, ?)
+            ''', (ts, EVENT_DETECTION, detection_id))
+            
+            self.conn.commit()
+            
+            # Write-through under the same lock: a racing clear_all() cannot
+            # re-warm the cache between the commit and the push
+            self.cache.push((person_count, now, confidence, image_path), person_count, confidence)
+        return detection_id
+    
+    def add_event(self, event_type, ts=None, detection_id=None, data=None, source='python'):
+        """
+        Ghi mot su kien vao bang events
         
-        self.conn.commit()
+        Dung truc tiep lam listener cho GateController.add_listener()
+        
+        Args:
+            event_type (str): Loai su kien (DETECTION, GATE_OPEN, MANUAL_OPEN, ...)
+            ts (float): Epoch timestamp (mac dinh: bay gio)
+            detection_id (int): ID ban ghi detection lien quan (optional)
+            data (dict): Du lieu them, luu dang JSON (optional)
+            source (str): Noi tao su kien
+        
+        Returns:
+            int: ID cua su kien vua them
+        """
+        ts = time.time() if ts is None else ts
+        payload = json.dumps(data, ensure_ascii=False) if data is not None else None
+        
+        with self.write_lock:
+            cursor = self.conn.cursor()
+            cursor.execute('''
+                INSERT INTO events (ts, event_type, source, detection_id, data)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (ts, event_type, source, detection_id, payload))
+            self.conn.commit()
         return cursor.lastrowid
     
+    def get_events(self, event_type=None, since=None, until=None, limit=100):
+        """
+        Lay su kien theo loai va khoang thoi gian (moi nhat truoc)
+        
+        Returns:
+            list: [dict voi cac truong EVENT_FIELDS, ...]
+        """
+        conditions = []
+        params = []
+        if event_type is not None:
+            conditions.append('event_type = ?')
+            params.append(event_type)
+        if since is not None:
+            conditions.append('ts >= ?')
+            params.append(since)
+        if until is not None:
+            conditions.append('ts < ?')
+            params.append(until)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        params.append(limit)
+        
+        cursor = self.conn.cursor()
+        cursor.execute(f'''
+            SELECT {', '.join(EVENT_FIELDS)}
+            FROM events
+            {where}
+            ORDER BY ts DESC, id DESC
+            LIMIT ?
+        ''', params)
+        events = []
+        for row in cursor.fetchall():
+            event = dict(zip(EVENT_FIELDS, row))
+            event['data'] = json.loads(event['data']) if event['data'] else None
+            events.append(event)
+        return events
+    
+    def get_detections_before_events(self, event_type, window=10.0, since=None, until=None):
+        """
+        Tuong quan: cac detection trong `window` giay truoc moi su kien
+        
+        Vd: get_detections_before_events('GATE_OPEN', 10) -> detection
+        trong 10 s truoc moi lan mo cong. Mot query, dung idx_events_type_ts
+        (CROSS JOIN giu events e o vong ngoai: chi phi ~ so su kien).
+        
+        Returns:
+            list: [(event_id, event_ts, detection_id, detection_ts, person_count, confidence), ...]
+        """
+        conditions = ['e.event_type = ?']
+        params = [window, EVENT_DETECTION, event_type]
+        if since is not None:
+            conditions.append('e.ts >= ?')
+            params.append(since)
+        if until is not None:
+            conditions.append('e.ts < ?')
+            params.append(until)
+        
+        cursor = self.conn.cursor()
+        cursor.execute(f'''
+            SELECT e.id, e.ts, d.id, d.ts, d.person_count, d.confidence
+            FROM events e
+            CROSS JOIN events de
+                ON de.ts >= e.ts - ? AND de.ts <= e.ts AND de.event_type = ?
+            JOIN detections d ON d.id = de.detection_id
+            WHERE {' AND '.join(conditions)}
+            ORDER BY e.ts, de.ts
+        ''', params)
+        return cursor.fetchall()
+    
     def get_all_detections(self):
-        """Lay tat ca ban ghi phat hien"""
+        """Lay tat ca ban ghi phat hien (bang lon -> dung iter_detections)"""
         cursor = self.conn.cursor()
         cursor.execute('''
             SELECT person_count, datetime, confidence, image_path
@@ -70,18 +348,138 @@ class DetectionDatabase:
         return cursor.fetchall()
     
     def get_recent_detections(self, limit=10):
-        """Lay N ban ghi gan nhat"""
+        """Lay N ban ghi gan nhat (tu cache neu limit <= cache_size)"""
+        rows = self.cache.get_recent(limit)
+        if rows is not None:
+            return rows
+        
         cursor = self.conn.cursor()
         cursor.execute('''
             SELECT person_count, datetime, confidence, image_path
             FROM detections
-            ORDER BY datetime DESC
+            ORDER BY id DESC
             LIMIT ?
         ''', (limit,))
         return cursor.fetchall()
     
+    def _keyset_query(self, since, until, after, limit):
+        """Tao query keyset theo (ts, id) - dung index idx_detections_ts"""
+        conditions = ['ts IS NOT NULL']
+        params = []
+        if after is not None:
+            conditions.append('(ts, id) > (?, ?)')
+            params.extend(after)
+        if since is not None:
+            conditions.append('ts >= ?')
+            params.append(since)
+        if until is not None:
+            conditions.append('ts < ?')
+            params.append(until)
+        params.append(limit)
+        
+        query = f'''
+            SELECT {', '.join(DETECTION_FIELDS)}
+            FROM detections
+            WHERE {' AND '.join(conditions)}
+            ORDER BY ts, id
+            LIMIT ?
+        '''
+        return query, params
+    
+    def iter_detections(self, since=None, until=None, after=None, chunk_size=500):
+        """
+        Duyet ban ghi theo thu tu thoi gian, bo nho khong doi
+        
+        Moi chunk la mot query keyset ngan (khong giu transaction doc
+        suot qua trinh export), doc bang fetchmany tren connection rieng.
+        
+        Args:
+            since (float): Epoch bat dau (bao gom)
+            until (float): Epoch ket thuc (khong bao gom)
+            after (tuple): Cursor (ts, id) - bat dau sau ban ghi nay
+            chunk_size (int): So ban ghi moi lan doc
+        
+        Yields:
+            dict: Ban ghi voi cac truong DETECTION_FIELDS
+        """
+        conn = sqlite3.connect(self.db_path)
+        try:
+            cursor = conn.cursor()
+            while True:
+                cursor.execute(*self._keyset_query(since, until, after, chunk_size))
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    return
+                for row in rows:
+                    yield dict(zip(DETECTION_FIELDS, row))
+                last = rows[-1]
+                after = (last[1], last[0])
+                if len(rows) < chunk_size:
+                    return
+        finally:
+            conn.close()
+    
+    def get_detection_page(self, since=None, until=None, after=None, limit=100):
+        """
+        Lay mot trang ban ghi (keyset pagination)
+        
+        Returns:
+            tuple: (records, next_cursor) - next_cursor la (ts, id) hoac None
+        """
+        cursor = self.conn.cursor()
+        cursor.execute(*self._keyset_query(since, until, after, limit))
+        records = [dict(zip(DETECTION_FIELDS, row)) for row in cursor.fetchall()]
+        next_cursor = None
+        if len(records) == limit:
+            next_cursor = (records[-1]['ts'], records[-1]['id'])
+        return records, next_cursor
+    
+    def get_snapshot_hashes(self):
+        """Lay (id, phash) cua cac anh goc (khong phai ban sao) de nap vao index"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT id, phash
+            FROM detections
+            WHERE phash IS NOT NULL AND duplicate_of IS NULL
+        ''')
+        return cursor.fetchall()
+    
+    def get_unhashed_detections(self):
+        """Lay (id, image_path) cua cac ban ghi chua co phash"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT id, image_path
+            FROM detections
+            WHERE phash IS NULL AND image_path IS NOT NULL
+        ''')
+        return cursor.fetchall()
+    
+    def set_detection_hash(self, detection_id, phash):
+        """Cap nhat phash cho mot ban ghi"""
+        cursor = self.conn.cursor()
+        cursor.execute('UPDATE detections SET phash = ? WHERE id = ?', (phash, detection_id))
+        self.conn.commit()
+    
+    def get_detections_by_ids(self, ids):
+        """Lay ban ghi theo danh sach ID (giu nguyen thu tu ids)"""
+        if not ids:
+            return []
+        cursor = self.conn.cursor()
+        placeholders = ','.join('?' * len(ids))
+        cursor.execute(f'''
+            SELECT id, person_count, datetime, confidence, image_path, phash
+            FROM detections
+            WHERE id IN ({placeholders})
+        ''', list(ids))
+        rows = {row[0]: row for row in cursor.fetchall()}
+        return [rows[i] for i in ids if i in rows]
+    
     def get_stats(self):
-        """Lay thong ke"""
+        """Lay thong ke (tu cache)"""
+        stats = self.cache.get_stats()
+        if stats is not None:
+            return stats
+        
         cursor = self.conn.cursor()
         
         # Tong so lan phat hien
@@ -103,12 +501,33 @@ class DetectionDatabase:
         }
     
     def clear_all(self):
-        """Xoa tat ca du lieu"""
-        cursor = self.conn.cursor()
-        cursor.execute('DELETE FROM detections')
-        self.conn.commit()
+        """Xoa tat ca du lieu phat hien (giu lich su cong trong events)"""
+        with self.write_lock:
+            cursor = self.conn.cursor()
+            cursor.execute('DELETE FROM detections')
+            cursor.execute('DELETE FROM events WHERE event_type = ?', (EVENT_DETECTION,))
+            self.conn.commit()
+            
+            # Invalidate cache, then reload (table is empty -> cheap)
+            self.cache.invalidate()
+            self._warm_cache()
+        
+        # Derived in-memory state (e.g. snapshot hash index) must drop deleted ids
+        for listener in self.clear_listeners:
+            try:
+                listener()
+            except Exception as e:
+                print(f"[DB] Clear listener error: {e}")
         print("[DB] Da xoa toan bo du lieu")
     
+    def add_clear_listener(self, listener):
+        """Dang ky callback goi sau clear_all()"""
+        self.clear_listeners.append(listener)
+    
+    def get_cache_stats(self):
+        """Lay hit/miss counters cua cache"""
+        return self.cache.get_counters()
+    
     def close(self):
         """Dong ket noi database"""
         if self.conn:
@@ -3,11 +3,15 @@ Detection System Module
 Person detection using YOLO11 + Flask streaming + Gate Control
 """
 import cv2
+import csv
+import hmac
+import io
+import json
 import time
 import os
 import sys
 from datetime import datetime
-from flask import Flask, Response, jsonify
+from flask import Flask, Response, jsonify, request, send_from_directory
 from flask_cors import CORS
 import threading
 import logging
@@ -18,7 +22,11 @@ sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 from ultralytics import YOLO
 from gate_controller import gate_controller
 from telegram_helper import telegram_bot
-from database import db
+from database import db, DETECTION_FIELDS
+from image_hash import SnapshotIndex, snapshot_hash, hash_to_hex, hex_to_hash, MAX_RADIUS
+from profiler import profiler
+from quantize_model import QUANTIZED_MODEL_PATH, QUANTIZED_REPORT_PATH
+from telemetry import FrameTelemetry
 
 
 class PersonDetectionSystem:
@@ -28,13 +36,18 @@ class PersonDetectionSystem:
         """Initialize the detection system"""
         print("[INIT] Dang khoi tao he thong phat hien nguoi...")
         
-        # Model path configuration
+        # Model path configuration (quantized artifact preferred when deployed)
+        self.model_report = None
         self.MODEL_PATH = self._find_model()
         
         # Load YOLO model
         print(f"[INIT] Dang load model: {self.MODEL_PATH}")
-        self.model = YOLO(self.MODEL_PATH)
+        self.model = YOLO(self.MODEL_PATH, task='detect')
         print(f"[INIT] Da load model YOLO11n")
+        if self.model_report:
+            print(f"[INIT] Model luong hoa ({self.model_report.get('mode')}): "
+                  f"speedup {self.model_report.get('speedup')}x, "
+                  f"recall {self.model_report.get('recall', 0):.3f} so voi FP32")
         
         # Detection configuration
         self.CONFIDENCE_THRESHOLD = 0.7  # Confidence >= 0.7 to light up
@@ -56,6 +69,14 @@ class PersonDetectionSystem:
         self.SAVE_INTERVAL = 10  # Save image every 10 seconds when person detected
         self.gate_opened_notified = False  # Track if we've sent Telegram for this OPEN
         
+        # Perceptual hash index - skip near-duplicate snapshots
+        self.snapshot_index = SnapshotIndex()
+        self.snapshot_index.load(db.get_snapshot_hashes())
+        db.add_clear_listener(self.snapshot_index.clear)
+        
+        # Per-frame telemetry log (database/telemetry, one file per day)
+        self.telemetry = FrameTelemetry()
+        
         # Realtime detection state for API
         self.current_person_detected = False
         self.current_person_count = 0
@@ -74,13 +95,23 @@ class PersonDetectionSystem:
         log.disabled = True
         self._setup_routes()
         
-        # Gate controller reference
+        # Gate controller reference - transitions and manual overrides go to the events table
         self.gate = gate_controller
+        self.gate.add_listener(db.add_event)
         
         print("[INIT] He thong da san sang")
     
     def _find_model(self) -> str:
         """Find YOLO model file"""
+        # Quantized model from quantize_model.py (disable with SMAC_USE_QUANTIZED=0)
+        if os.environ.get('SMAC_USE_QUANTIZED', '1') != '0' and os.path.exists(QUANTIZED_MODEL_PATH):
+            try:
+                with open(QUANTIZED_REPORT_PATH, encoding='utf-8') as f:
+                    self.model_report = json.load(f)
+            except (OSError, ValueError):
+                self.model_report = {}
+            return QUANTIZED_MODEL_PATH
+        
         # Priority order for model paths
         paths = [
             "AI_model/yolo11n.pt",
@@ -137,6 +168,237 @@ class PersonDetectionSystem:
         def api_gate_close():
             self.gate.force_close()
             return jsonify({"status": "success", "gate": "CLOSED"})
+        
+        @self.app.route('/api/detections/recent')
+        def api_recent_detections():
+            """Recent detections - served from the write-through cache"""
+            limit = request.args.get('limit', 10, type=int)
+            records = db.get_recent_detections(limit)
+            return jsonify({
+                "status": "success",
+                "detections": [
+                    {
+                        "person_count": r[0],
+                        "datetime": r[1],
+                        "confidence": round(r[2], 2),
+                        "image_path": r[3]
+                    }
+                    for r in records
+                ]
+            })
+        
+        @self.app.route('/api/detections/stats')
+        def api_detection_stats():
+            stats = db.get_stats()
+            return jsonify({
+                "status": "success",
+                "total_detections": stats["total_detections"],
+                "avg_confidence": round(stats["avg_confidence"], 2),
+                "max_people": stats["max_people"],
+                "cache": db.get_cache_stats()
+            })
+        
+        @self.app.route('/api/detections/history')
+        def api_detection_history():
+            """One keyset page of detections (oldest first), use next_cursor for the next page"""
+            try:
+                since = self._parse_time_arg(request.args.get('since'))
+                until = self._parse_time_arg(request.args.get('until'))
+                after = self._parse_cursor_arg(request.args.get('cursor'))
+            except ValueError:
+                return jsonify({"status": "error", "message": "Invalid since/until/cursor"}), 400
+            
+            limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+            records, next_cursor = db.get_detection_page(since, until, after, limit)
+            return jsonify({
+                "status": "success",
+                "detections": records,
+                "next_cursor": f"{next_cursor[0]!r}:{next_cursor[1]}" if next_cursor else None
+            })
+        
+        @self.app.route('/api/detections/export')
+        def api_detection_export():
+            """Stream all detections as NDJSON (default) or CSV in constant memory"""
+            try:
+                since = self._parse_time_arg(request.args.get('since'))
+                until = self._parse_time_arg(request.args.get('until'))
+            except ValueError:
+                return jsonify({"status": "error", "message": "Invalid since/until"}), 400
+            
+            export_format = request.args.get('format', 'ndjson')
+            if export_format not in ('ndjson', 'csv'):
+                return jsonify({"status": "error", "message": "format must be ndjson or csv"}), 400
+            
+            records = db.iter_detections(since, until)
+            if export_format == 'csv':
+                return Response(
+                    self._export_chunks(records, export_format),
+                    mimetype='text/csv',
+                    headers={'Content-Disposition': 'attachment; filename=detections.csv'}
+                )
+            return Response(self._export_chunks(records, export_format), mimetype='application/x-ndjson')
+        
+        @self.app.route('/api/events')
+        def api_events():
+            """Typed events (DETECTION, GATE_OPEN, GATE_CLOSE, MANUAL_OPEN, MANUAL_CLOSE)"""
+            try:
+                since = self._parse_time_arg(request.args.get('since'))
+                until = self._parse_time_arg(request.args.get('until'))
+            except ValueError:
+                return jsonify({"status": "error", "message": "Invalid since/until"}), 400
+            
+            limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+            events = db.get_events(request.args.get('type'), since, until, limit)
+            return jsonify({"status": "success", "events": events})
+        
+        @self.app.route('/api/events/correlate')
+        def api_events_correlate():
+            """Detections within `window` seconds before each event (default: GATE_OPEN, 10 s)"""
+            try:
+                since = self._parse_time_arg(request.args.get('since'))
+                until = self._parse_time_arg(request.args.get('until'))
+            except ValueError:
+                return jsonify({"status": "error", "message": "Invalid since/until"}), 400
+            
+            event_type = request.args.get('event', self.gate.EVENT_OPEN)
+            window = request.args.get('window', 10.0, type=float)
+            rows = db.get_detections_before_events(event_type, window, since, until)
+            return jsonify({
+                "status": "success",
+                "event": event_type,
+                "window": window,
+                "matches": [
+                    {
+                        "event_id": r[0],
+                        "event_ts": r[1],
+                        "detection_id": r[2],
+                        "detection_ts": r[3],
+                        "person_count": r[4],
+                        "confidence": round(r[5], 2)
+                    }
+                    for r in rows
+                ]
+            })
+        
+        @self.app.route('/api/model')
+        def api_model():
+            return jsonify({
+                "model_path": os.path.basename(self.MODEL_PATH),
+                "quantized": self.model_report is not None,
+                "report": self.model_report
+            })
+        
+        @self.app.route('/api/admin/profile', methods=['POST'])
+        def api_admin_profile():
+            """Profile all threads for `duration` seconds (blocks until done)"""
+            auth_error = self._admin_auth_error()
+            if auth_error:
+                return auth_error
+            
+            duration = request.args.get('duration', 5.0, type=float)
+            interval_ms = request.args.get('interval_ms', 5.0, type=float)
+            try:
+                result = profiler.capture(duration, max(interval_ms, 1.0) / 1000)
+            except RuntimeError as e:
+                return jsonify({"status": "error", "message": str(e)}), 409
+            return jsonify({"status": "success", **result})
+        
+        @self.app.route('/api/admin/profile/<path:filename>')
+        def api_admin_profile_file(filename):
+            """Download a .folded or .trace.json file from a previous capture"""
+            auth_error = self._admin_auth_error()
+            if auth_error:
+                return auth_error
+            return send_from_directory(profiler.output_dir, filename, as_attachment=True)
+        
+        @self.app.route('/api/snapshots/<int:detection_id>/similar')
+        def api_similar_snapshots(detection_id):
+            rows = db.get_detections_by_ids([detection_id])
+            if not rows or not rows[0][5]:
+                return jsonify({"status": "error", "message": "Snapshot not found or not hashed"}), 404
+            
+            radius = request.args.get('radius', MAX_RADIUS, type=int)
+            limit = request.args.get('limit', 20, type=int)
+            if not 0 <= radius <= MAX_RADIUS:
+                return jsonify({"status": "error", "message": f"radius must be 0..{MAX_RADIUS}"}), 400
+            matches = self.snapshot_index.find_similar(hex_to_hash(rows[0][5]), radius, limit + 1)
+            matches = [(d, i) for d, i in matches if i != detection_id][:limit]
+            
+            records = db.get_detections_by_ids([i for _, i in matches])
+            distances = {i: d for d, i in matches}
+            return jsonify({
+                "status": "success",
+                "detection_id": detection_id,
+                "similar": [
+                    {
+                        "id": r[0],
+                        "distance": distances[r[0]],
+                        "person_count": r[1],
+                        "datetime": r[2],
+                        "confidence": round(r[3], 2),
+                        "image_path": r[4]
+                    }
+                    for r in records
+                ]
+            })
+    
+    @staticmethod
+    def _admin_auth_error():
+        """
+        Check X-Admin-Token against SMAC_ADMIN_TOKEN
+        
+        Admin endpoints are disabled (403) until a token is configured.
+        
+        Returns:
+            Error response tuple, or None if authorized
+        """
+        token = os.environ.get('SMAC_ADMIN_TOKEN', '')
+        if not token:
+            return jsonify({"status": "error", "message": "Admin endpoints disabled (set SMAC_ADMIN_TOKEN)"}), 403
+        provided = request.headers.get('X-Admin-Token', '')
+        if not hmac.compare_digest(provided.encode(), token.encode()):
+            return jsonify({"status": "error", "message": "Unauthorized"}), 401
+        return None
+    
+    @staticmethod
+    def _parse_time_arg(value):
+        """Parse epoch seconds or ISO date/datetime query arg (None if empty)"""
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return datetime.fromisoformat(value).timestamp()
+    
+    @staticmethod
+    def _parse_cursor_arg(value):
+        """Parse 'ts:id' pagination cursor (None if empty)"""
+        if not value:
+            return None
+        ts, detection_id = value.split(':')
+        return float(ts), int(detection_id)
+    
+    def _export_chunks(self, records, export_format, batch_size=500):
+        """Encode records as NDJSON/CSV text, yielding one batch of lines at a time"""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer) if export_format == 'csv' else None
+        if writer:
+            writer.writerow(DETECTION_FIELDS)
+        
+        count = 0
+        for record in records:
+            if writer:
+                writer.writerow([record[field] for field in DETECTION_FIELDS])
+            else:
+                buffer.write(json.dumps(record, ensure_ascii=False) + '\n')
+            count += 1
+            if count % batch_size == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        
+        if buffer.tell():
+            yield buffer.getvalue()
     
     def _get_countdown_display(self):
         """Get countdown remaining time for frontend display"""
@@ -156,7 +418,8 @@ class PersonDetectionSystem:
                     continue
                 frame_copy = self.frame.copy()
             
-            ret, buffer = cv2.imencode('.jpg', frame_copy, [cv2.IMWRITE_JPEG_QUALITY, 80])
+            with profiler.span("encode"):
+                ret, buffer = cv2.imencode('.jpg', frame_copy, [cv2.IMWRITE_JPEG_QUALITY, 80])
             if ret:
                 yield (b'--frame\r\n'
                        b'Content-Type: image/jpeg\r\n\r\n' + buffer.tobytes() + b'\r\n')
@@ -170,8 +433,10 @@ class PersonDetectionSystem:
         Returns:
             tuple: (processed_frame, person_count, max_confidence)
         """
-        results = self.model(frame, verbose=False)
+        with profiler.span("infer"):
+            results = self.model(frame, verbose=False)
         
+        annotate_start = profiler.now()
         person_count = 0
         max_confidence = 0
         
@@ -218,10 +483,39 @@ class PersonDetectionSystem:
         cv2.putText(frame, f"Gate IN: {gate_state}", (frame.shape[1] - 180, 50),
                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, gate_color, 2)
         
+        profiler.record("annotate", annotate_start)
         return frame, person_count, max_confidence
     
-    def save_detection(self, frame, person_count, confidence):
-        """Save detection image and log to database"""
+    def save_detection(self, frame, person_count, confidence, dedup=True):
+        """
+        Save detection image and log to database
+        
+        Near-duplicate images (same scene within SnapshotIndex.DUPLICATE_WINDOW)
+        are not written again - the record links to the existing image instead.
+        
+        Args:
+            dedup: Link near-duplicates instead of writing them. The hash is
+                   dominated by the background, so the first save of a new
+                   detection (Telegram alert) passes False to always get a
+                   fresh image of whoever just arrived.
+        
+        Returns:
+            tuple: (filepath, is_duplicate)
+        """
+        phash_value = snapshot_hash(frame)
+        phash = hash_to_hex(phash_value)
+        
+        duplicate = self.snapshot_index.find_duplicate(phash_value) if dedup else None
+        if duplicate is not None:
+            duplicate_id, filepath, distance = duplicate
+            print(f"[SAVE] Ảnh gần trùng #{duplicate_id} (distance={distance}), bỏ qua ghi file")
+            try:
+                with profiler.span("db"):
+                    db.add_detection(person_count, confidence, filepath, phash, duplicate_of=duplicate_id)
+            except Exception as e:
+                print(f"[DB] Lỗi lưu database: {e}")
+            return filepath, True
+        
         timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
         filename = f"person_{timestamp}.png"
         filepath = os.path.join(self.SAVE_DIR, filename)
@@ -232,17 +526,20 @@ class PersonDetectionSystem:
         
         # Save to database
         try:
-            db.add_detection(person_count, confidence, filepath)
+            with profiler.span("db"):
+                detection_id = db.add_detection(person_count, confidence, filepath, phash)
+            self.snapshot_index.add(phash_value, detection_id, filepath)
             print(f"[DB] Đã lưu vào database")
         except Exception as e:
             print(f"[DB] Lỗi lưu database: {e}")
         
-        return filepath
+        return filepath, False
     
     def send_telegram_alert(self, filepath, person_count, confidence):
         """Send Telegram alert for gate opening"""
         try:
-            success = telegram_bot.send_detection_alert(filepath, person_count, confidence)
+            with profiler.span("notify"):
+                success = telegram_bot.send_detection_alert(filepath, person_count, confidence)
             if success:
                 print("[Telegram] Đã gửi thông báo")
             return success
@@ -265,7 +562,7 @@ class PersonDetectionSystem:
         print("[START] Bat dau he thong phat hien...")
         
         # Start Flask server
-        flask_thread = threading.Thread(target=self.run_flask, daemon=True)
+        flask_thread = threading.Thread(target=self.run_flask, name="flask", daemon=True)
         flask_thread.start()
         print("[Flask] Server dang chay: http://localhost:8000")
         
@@ -288,11 +585,15 @@ class PersonDetectionSystem:
         
         try:
             while self.running:
-                ret, frame = cap.read()
+                frame_start = profiler.now()
+                with profiler.span("read"):
+                    ret, frame = cap.read()
                 if not ret:
                     print("[WARN] Khong doc duoc frame, dang thu lai...")
                     time.sleep(0.1)
                     continue
+                capture_ts = time.time()
+                capture_start = time.perf_counter()
                 
                 # Process frame
                 processed_frame, person_count, confidence = self.process_frame(frame)
@@ -318,7 +619,8 @@ class PersonDetectionSystem:
                     # Check if we should send telegram (first detection or after cooldown)
                     if not self.telegram_sent_for_detection:
                         if (current_time - self.last_telegram_time) >= self.TELEGRAM_COOLDOWN:
-                            filepath = self.save_detection(processed_frame, person_count, confidence)
+                            # New arrival - always a fresh image, never a linked duplicate
+                            filepath, _ = self.save_detection(processed_frame, person_count, confidence, dedup=False)
                             self.send_telegram_alert(filepath, person_count, confidence)
                             self.last_telegram_time = current_time
                             self.telegram_sent_for_detection = True
@@ -339,12 +641,21 @@ class PersonDetectionSystem:
                         self.save_detection(processed_frame, person_count, confidence)
                         self.last_save_time = current_time
                 
+                # Frame telemetry (buffered, one write per FLUSH_EVERY frames)
+                self.telemetry.append(
+                    capture_ts, person_count, confidence,
+                    self.gate.state == self.gate.STATE_OPEN,
+                    (time.perf_counter() - capture_start) * 1000
+                )
+                
                 # Show OpenCV window
                 if show_window:
                     cv2.imshow('Person Detection', processed_frame)
                     if cv2.waitKey(1) & 0xFF == ord('q'):
                         print("\n[STOP] Dung boi nguoi dung...")
                         break
+                
+                profiler.record("frame", frame_start)
         
         except KeyboardInterrupt:
             print("\n[STOP] Dung boi Ctrl+C...")
@@ -353,6 +664,7 @@ class PersonDetectionSystem:
             self.running = False
             cap.release()
             cv2.destroyAllWindows()
+            self.telemetry.close()
             self.gate.cleanup()
             print("[DONE] Da dung he thong")
 
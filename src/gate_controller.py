@@ -20,6 +20,12 @@ class GateController:
     STATE_CLOSED = "CLOSED"
     STATE_OPEN = "OPEN"
     
+    # Event types (passed to listeners, stored in the events table)
+    EVENT_OPEN = "GATE_OPEN"
+    EVENT_CLOSE = "GATE_CLOSE"
+    EVENT_MANUAL_OPEN = "MANUAL_OPEN"
+    EVENT_MANUAL_CLOSE = "MANUAL_CLOSE"
+    
     # Timing constants (seconds)
     OPEN_DELAY = 10.0     # Time person must be present to open gate (10s countdown)
     CLOSE_DELAY = 0.5     # Quick close when no person detected
@@ -29,6 +35,7 @@ class GateController:
         self.state = self.STATE_CLOSED
         self.person_present_start = None  # When person first detected
         self.person_absent_start = None   # When person first disappeared
+        self.listeners = []               # Callbacks: listener(event_type, ts=..., data=...)
         
         print(f"[Gate] Initialized - State: {self.state}")
     
@@ -73,31 +80,53 @@ class GateController:
         
         return self.state
     
-    def _open_gate(self):
+    def add_listener(self, listener):
+        """
+        Register a callback for gate events
+        
+        Args:
+            listener: Callable(event_type, ts=float, data=dict)
+        """
+        self.listeners.append(listener)
+    
+    def _emit(self, event_type, data):
+        """Notify listeners - a failing listener never blocks the gate"""
+        ts = time.time()
+        for listener in self.listeners:
+            try:
+                listener(event_type, ts=ts, data=data)
+            except Exception as e:
+                print(f"[Gate] Listener error: {e}")
+    
+    def _open_gate(self, trigger="auto"):
         """Open the gate"""
         if self.state != self.STATE_OPEN:
             self.state = self.STATE_OPEN
             print(f"[Gate] IN -> OPEN 🚪")
+            self._emit(self.EVENT_OPEN, {"from": self.STATE_CLOSED, "trigger": trigger})
             return True
         return False
     
-    def _close_gate(self):
+    def _close_gate(self, trigger="auto"):
         """Close the gate"""
         if self.state != self.STATE_CLOSED:
             self.state = self.STATE_CLOSED
             print(f"[Gate] IN -> CLOSED 🔒")
+            self._emit(self.EVENT_CLOSE, {"from": self.STATE_OPEN, "trigger": trigger})
             return True
         return False
     
     def force_open(self):
         """Force open gate (manual control)"""
+        self._emit(self.EVENT_MANUAL_OPEN, {"state": self.state})
         self.person_present_start = time.time() - self.OPEN_DELAY  # Instant open
-        return self._open_gate()
+        return self._open_gate(trigger="manual")
     
     def force_close(self):
         """Force close gate (manual control)"""
+        self._emit(self.EVENT_MANUAL_CLOSE, {"state": self.state})
         self.person_absent_start = time.time() - self.CLOSE_DELAY  # Instant close
-        return self._close_gate()
+        return self._close_gate(trigger="manual")
     
     def get_status(self) -> dict:
         """Get current gate status"""
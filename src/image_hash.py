@@ -0,0 +1,297 @@
+"""
+Image Hash Module
+Perceptual hash (dHash 64-bit) + multi-index hash cho anh snapshot
+Dung de bo qua anh gan giong nhau va tim anh tuong tu
+"""
+import time
+import threading
+from collections import deque
+from itertools import combinations
+
+import cv2
+import numpy as np
+
+
+HASH_SIZE = 8  # 8x8 = 64 bit
+STATUS_BAR_HEIGHT = 70  # Overlay drawn by PersonDetectionSystem.process_frame
+
+
+def compute_dhash(image, hash_size=HASH_SIZE) -> int:
+    """
+    Tinh difference hash (dHash) cua anh
+    
+    Args:
+        image: Anh BGR hoac grayscale (numpy array tu OpenCV)
+        hash_size: Kich thuoc hash (8 -> 64 bit)
+    
+    Returns:
+        int: Hash 64 bit (unsigned)
+    """
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    # Resize to (hash_size + 1) x hash_size, compare adjacent columns
+    small = cv2.resize(image, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    diff = small[:, 1:] > small[:, :-1]
+    
+    value = 0
+    for bit in diff.flatten():
+        value = (value << 1) | int(bit)
+    return value
+
+
+def snapshot_hash(frame) -> int:
+    """
+    Hash cua anh snapshot, bo qua status bar phia tren
+    
+    Status bar chua dong ho (doi moi frame) nen khong dua vao hash.
+    Dung chung cho luu anh moi va backfill anh cu de hash so sanh duoc.
+    """
+    return compute_dhash(frame[STATUS_BAR_HEIGHT:])
+
+
+def hash_to_hex(value: int) -> str:
+    """Chuyen hash sang chuoi hex 16 ky tu (luu vao SQLite)"""
+    return f"{value:016x}"
+
+
+def hex_to_hash(text: str) -> int:
+    """Chuyen chuoi hex ve hash int"""
+    return int(text, 16)
+
+
+def hamming_distance(a: int, b: int) -> int:
+    """So bit khac nhau giua 2 hash"""
+    return bin(a ^ b).count("1")
+
+
+# Multi-index hashing: hash 64 bit chia thanh 4 band 16 bit. Neu hai hash
+# cach nhau <= r bit thi (pigeonhole) it nhat mot band cach nhau <= r // 4 bit
+BAND_BITS = 16
+BAND_COUNT = 4
+BAND_MASK = (1 << BAND_BITS) - 1
+MAX_RADIUS = 8  # -> moi band chi can thu cac bien the lech <= 2 bit (137 key)
+
+# Popcount tung byte, dung cho khoang cach Hamming vector hoa
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _band_flips(max_flips):
+    """Tat ca mask 16 bit co <= max_flips bit 1"""
+    masks = [0]
+    for flips in range(1, max_flips + 1):
+        masks.extend(sum(1 << bit for bit in bits) for bits in combinations(range(BAND_BITS), flips))
+    return np.array(masks, dtype=np.uint16)
+
+
+_BAND_FLIPS = [_band_flips(k) for k in range(MAX_RADIUS // BAND_COUNT + 1)]
+
+
+def hamming_distances(hashes, value: int):
+    """Khoang cach Hamming tu `value` den tung phan tu cua mang uint64"""
+    xor = np.ascontiguousarray(hashes ^ np.uint64(value))
+    return _POPCOUNT[xor.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+class MultiIndexHash:
+    """
+    Index hash 64 bit cho truy van "tim hash trong ban kinh r" (r <= MAX_RADIUS)
+    
+    - Phan chinh: mang NumPy (hash, id) + moi band mot mang da sap xep,
+      tra cuu bang searchsorted -> chi kiem tra cac ung vien trung band
+    - Hash moi them vao danh sach pending (scan tuyen tinh), gop vao
+      phan chinh moi REBUILD_EVERY hash
+    - Search chi giu lock trong luc lay snapshot, tinh toan ngoai lock
+    """
+    
+    REBUILD_EVERY = 4096
+    
+    def __init__(self):
+        """Initialize empty index"""
+        self.lock = threading.Lock()
+        self.base = self._build(np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.int64))
+        self.pending = []  # [(hash, id), ...] chua gop vao base
+    
+    @staticmethod
+    def _build(hashes, ids):
+        """Tao phan chinh (immutable tuple) tu mang hash va id"""
+        sorted_bands, orders = [], []
+        for band in range(BAND_COUNT):
+            values = ((hashes >> np.uint64(band * BAND_BITS)) & np.uint64(BAND_MASK)).astype(np.uint16)
+            order = np.argsort(values, kind='stable')
+            sorted_bands.append(values[order])
+            orders.append(order)
+        return hashes, ids, sorted_bands, orders
+    
+    def load(self, hashes, ids):
+        """Thay toan bo index bang mang hash (uint64) va id (int64)"""
+        base = self._build(np.asarray(hashes, dtype=np.uint64), np.asarray(ids, dtype=np.int64))
+        with self.lock:
+            self.base = base
+            self.pending = []
+    
+    def add(self, value: int, item: int):
+        """
+        Them hash vao index
+        
+        Args:
+            value: Hash 64 bit
+            item: Detection id
+        """
+        with self.lock:
+            self.pending.append((value, item))
+            if len(self.pending) < self.REBUILD_EVERY:
+                return
+            hashes, ids = self.base[0], self.base[1]
+            extra_hashes, extra_ids = zip(*self.pending)
+            self.base = self._build(
+                np.concatenate([hashes, np.array(extra_hashes, dtype=np.uint64)]),
+                np.concatenate([ids, np.array(extra_ids, dtype=np.int64)])
+            )
+            self.pending = []
+    
+    def search(self, value: int, radius: int) -> list:
+        """
+        Tim tat ca item co khoang cach <= radius (radius bi gioi han o MAX_RADIUS)
+        
+        Returns:
+            list: [(distance, item), ...] sap xep theo distance tang dan
+        """
+        radius = min(radius, MAX_RADIUS)
+        if radius < 0:
+            return []
+        with self.lock:
+            (hashes, ids, sorted_bands, orders), pending = self.base, list(self.pending)
+        
+        results = []
+        flips = _BAND_FLIPS[radius // BAND_COUNT]
+        candidates = []
+        for band in range(BAND_COUNT):
+            keys = np.uint16((value >> (band * BAND_BITS)) & BAND_MASK) ^ flips
+            left = np.searchsorted(sorted_bands[band], keys, side='left')
+            right = np.searchsorted(sorted_bands[band], keys, side='right')
+            hit = left < right
+            candidates.extend(orders[band][lo:hi] for lo, hi in zip(left[hit], right[hit]))
+        if candidates:
+            rows = np.unique(np.concatenate(candidates))
+            distances = hamming_distances(hashes[rows], value)
+            keep = distances <= radius
+            results.extend(zip(distances[keep].tolist(), ids[rows[keep]].tolist()))
+        
+        for pending_hash, item in pending:
+            distance = hamming_distance(value, pending_hash)
+            if distance <= radius:
+                results.append((distance, item))
+        
+        results.sort(key=lambda r: r[0])
+        return results
+    
+    def __len__(self):
+        return len(self.base[0]) + len(self.pending)
+
+
+class SnapshotIndex:
+    """
+    Index cho anh snapshot da luu
+    
+    - Cua so thoi gian ngan (recent) de phat hien anh gan trung lap
+    - Multi-index hash cho truy van "tim anh tuong tu" tren toan bo lich su
+      (lock rieng, khong chan find_duplicate cua vong lap detection)
+    """
+    
+    # Dedup configuration
+    DUPLICATE_DISTANCE = 6    # Hamming distance <= 6/64 bit -> gan trung lap
+    DUPLICATE_WINDOW = 60.0   # Chi so sanh voi anh trong 60 giay gan nhat
+    
+    def __init__(self, duplicate_distance=None, duplicate_window=None):
+        """Initialize snapshot index"""
+        if duplicate_distance is not None:
+            self.DUPLICATE_DISTANCE = duplicate_distance
+        if duplicate_window is not None:
+            self.DUPLICATE_WINDOW = duplicate_window
+        
+        self.similar = MultiIndexHash()
+        self.recent = deque()  # (saved_at, hash, detection_id, image_path)
+        self.lock = threading.Lock()
+    
+    def load(self, rows):
+        """
+        Nap hash tu database vao index tim anh tuong tu
+        
+        Args:
+            rows: Iterable (detection_id, phash_hex)
+        """
+        ids, hashes = [], []
+        for detection_id, phash in rows:
+            if phash:
+                ids.append(detection_id)
+                hashes.append(hex_to_hash(phash))
+        self.similar.load(np.array(hashes, dtype=np.uint64), np.array(ids, dtype=np.int64))
+        print(f"[Hash] Da nap {len(ids)} hash vao index")
+        return len(ids)
+    
+    def find_duplicate(self, value: int, now=None):
+        """
+        Tim anh gan trung lap trong cua so thoi gian
+        
+        Returns:
+            tuple | None: (detection_id, image_path, distance) neu co
+        """
+        now = time.time() if now is None else now
+        with self.lock:
+            # Drop entries outside the time window
+            while self.recent and now - self.recent[0][0] > self.DUPLICATE_WINDOW:
+                self.recent.popleft()
+            
+            best = None
+            for _, recent_hash, detection_id, image_path in self.recent:
+                distance = hamming_distance(value, recent_hash)
+                if distance <= self.DUPLICATE_DISTANCE and (best is None or distance < best[2]):
+                    best = (detection_id, image_path, distance)
+            return best
+    
+    def add(self, value: int, detection_id, image_path, now=None):
+        """Them anh moi luu vao index"""
+        now = time.time() if now is None else now
+        self.similar.add(value, detection_id)
+        with self.lock:
+            self.recent.append((now, value, detection_id, image_path))
+    
+    def find_similar(self, value: int, radius=MAX_RADIUS, limit=20) -> list:
+        """
+        Tim anh tuong tu tren toan bo lich su
+        
+        Args:
+            radius: Khoang cach Hamming toi da (gioi han o MAX_RADIUS)
+        
+        Returns:
+            list: [(distance, detection_id), ...]
+        """
+        return self.similar.search(value, radius)[:limit]
+    
+    def clear(self):
+        """Xoa toan bo index (sau khi database bi xoa)"""
+        self.similar.load([], [])
+        with self.lock:
+            self.recent.clear()
+        print("[Hash] Da xoa index")
+
+
+if __name__ == "__main__":
+    # Backfill hash cho cac ban ghi cu chua co phash
+    import os
+    import sys
+    
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from database import db
+    
+    print("Backfilling perceptual hashes...")
+    updated = 0
+    for detection_id, image_path in db.get_unhashed_detections():
+        if not image_path or not os.path.exists(image_path):
+            continue
+        image = cv2.imread(image_path)
+        if image is None:
+            continue
+        db.set_detection_hash(detection_id, hash_to_hex(snapshot_hash(image)))
+        updated += 1
+    print(f"Da cap nhat {updated} ban ghi")
@@ -0,0 +1,221 @@
+"""
+Profiler Module
+On-demand stack sampling + per-frame spans
+Xuat folded stacks (flamegraph) va Chrome trace JSON
+"""
+import os
+import sys
+import json
+import time
+import threading
+from collections import Counter
+from datetime import datetime
+
+
+class _NullSpan:
+    """No-op span used while profiling is disabled"""
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    """Timed span, recorded on exit"""
+    
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0
+    
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, self.start)
+        return False
+
+
+class Profiler:
+    """
+    Sampling profiler + span tracer
+    
+    - Khi tat: span()/now() chi kiem tra mot bien bool (overhead ~0)
+    - Khi bat: thread rieng lay mau stack cua moi thread theo chu ky,
+      cac doan code duoc danh dau ghi lai thanh span (read, infer, ...)
+    """
+    
+    MAX_DURATION = 60.0       # seconds
+    MAX_SPANS = 200000        # Safety cap on recorded spans per capture
+    
+    def __init__(self, output_dir=None):
+        """Initialize profiler (disabled)"""
+        if output_dir is None:
+            output_dir = os.path.join(os.path.dirname(__file__), '..', 'database', 'profiles')
+        self.output_dir = os.path.abspath(output_dir)
+        
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.samples = Counter()
+        self.spans = []
+        self.sample_count = 0
+        self.origin = 0
+        self._sampler = None
+        self._stop_event = threading.Event()
+    
+    def span(self, name):
+        """Context manager do thoi gian mot doan code"""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name)
+    
+    def now(self):
+        """Thoi diem bat dau span (None khi tat) - dung cung record()"""
+        if not self.enabled:
+            return None
+        return time.perf_counter()
+    
+    def record(self, name, start):
+        """Ghi span tu `start` (perf_counter) den hien tai"""
+        if start is None or not self.enabled:
+            return
+        end = time.perf_counter()
+        thread = threading.current_thread()
+        with self.lock:
+            if len(self.spans) < self.MAX_SPANS:
+                self.spans.append((name, thread.ident, thread.name, start, end))
+    
+    def _sample_loop(self, interval):
+        """Lay mau stack cua tat ca thread (tru chinh no)"""
+        own_id = threading.get_ident()
+        while not self._stop_event.wait(interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            frames = sys._current_frames()
+            with self.lock:
+                for thread_id, frame in frames.items():
+                    if thread_id == own_id:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                        frame = frame.f_back
+                    stack.append(names.get(thread_id, str(thread_id)))
+                    self.samples[';'.join(reversed(stack))] += 1
+                self.sample_count += 1
+    
+    def start(self, interval=0.005):
+        """
+        Bat dau profiling
+        
+        Args:
+            interval: Chu ky lay mau stack (giay)
+        """
+        with self.lock:
+            if self.enabled:
+                raise RuntimeError("Profiling already running")
+            self.samples = Counter()
+            self.spans = []
+            self.sample_count = 0
+            self.origin = time.perf_counter()
+            self._stop_event.clear()
+            self.enabled = True
+        
+        self._sampler = threading.Thread(
+            target=self._sample_loop, args=(interval,), name="profiler", daemon=True
+        )
+        self._sampler.start()
+        print(f"[Profiler] Started (interval={interval * 1000:.1f} ms)")
+    
+    def stop(self):
+        """Dung profiling, tra ve (samples, spans)"""
+        self.enabled = False
+        self._stop_event.set()
+        if self._sampler is not None:
+            self._sampler.join()
+            self._sampler = None
+        with self.lock:
+            return Counter(self.samples), list(self.spans)
+    
+    def _to_chrome_trace(self, spans):
+        """Chuyen spans sang Chrome trace event format (chrome://tracing, Perfetto)"""
+        pid = os.getpid()
+        events = []
+        thread_names = {}
+        for name, thread_id, thread_name, start, end in spans:
+            thread_names[thread_id] = thread_name
+            events.append({
+                "name": name,
+                "cat": "frame",
+                "ph": "X",
+                "ts": round((start - self.origin) * 1e6, 1),
+                "dur": round((end - start) * 1e6, 1),
+                "pid": pid,
+                "tid": thread_id
+            })
+        for thread_id, thread_name in thread_names.items():
+            events.append({
+                "name": "thread_name",
+                "ph": "M",
+                "pid": pid,
+                "tid": thread_id,
+                "args": {"name": thread_name}
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+    
+    def capture(self, duration=5.0, interval=0.005):
+        """
+        Profile trong `duration` giay va ghi ket qua ra file
+        
+        Returns:
+            dict: Tom tat + ten file (.folded va .trace.json)
+        """
+        duration = min(max(duration, 0.1), self.MAX_DURATION)
+        self.start(interval)
+        try:
+            time.sleep(duration)
+        finally:
+            samples, spans = self.stop()
+        
+        os.makedirs(self.output_dir, exist_ok=True)
+        name = f"profile_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}"
+        folded_file = f"{name}.folded"
+        trace_file = f"{name}.trace.json"
+        
+        # Folded stacks: "thread;outer;...;inner count" (flamegraph.pl, speedscope)
+        with open(os.path.join(self.output_dir, folded_file), 'w', encoding='utf-8') as f:
+            for stack, count in samples.most_common():
+                f.write(f"{stack} {count}\n")
+        
+        with open(os.path.join(self.output_dir, trace_file), 'w', encoding='utf-8') as f:
+            json.dump(self._to_chrome_trace(spans), f)
+        
+        span_totals = {}
+        for span_name, _, _, start, end in spans:
+            total = span_totals.setdefault(span_name, [0, 0.0])
+            total[0] += 1
+            total[1] += end - start
+        
+        print(f"[Profiler] Saved: {folded_file}, {trace_file}")
+        return {
+            "duration": duration,
+            "samples": sum(samples.values()),
+            "sample_ticks": self.sample_count,
+            "spans": len(spans),
+            "span_summary": {
+                span_name: {"count": count, "avg_ms": round(total / count * 1000, 3)}
+                for span_name, (count, total) in span_totals.items()
+            },
+            "folded": folded_file,
+            "trace": trace_file
+        }
+
+
+# Global instance for easy import
+profiler = Profiler()
@@ -0,0 +1,287 @@
+"""
+Quantize Model Module
+Luong hoa YOLO11n (INT8 dynamic/static hoac FP16) sang ONNX
+Calibration bang anh snapshot cua chinh he thong + accuracy gate truoc khi deploy
+
+Usage:
+    python quantize_model.py --mode static --tolerance 0.02
+"""
+import os
+import sys
+import json
+import glob
+import time
+import shutil
+import argparse
+from datetime import datetime, timedelta
+
+import cv2
+import numpy as np
+
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+MODEL_DIR = os.path.join(BASE_DIR, 'AI_model')
+IMAGE_DIR = os.path.join(BASE_DIR, 'database', 'data_images')
+
+# Deployed artifact - PersonDetectionSystem loads this when present
+QUANTIZED_MODEL_PATH = os.path.join(MODEL_DIR, 'yolo11n_quantized.onnx')
+QUANTIZED_REPORT_PATH = os.path.join(MODEL_DIR, 'yolo11n_quantized.json')
+
+CONFIDENCE_THRESHOLD = 0.7  # Same as PersonDetectionSystem
+PERSON_CLASS_ID = 0
+IOU_MATCH = 0.5             # Box IoU to count as the same person
+IMG_SIZE = 640
+
+# Snapshot filename formats (PersonDetectionSystem / older captures)
+SNAPSHOT_NAME_FORMATS = ('person_%Y-%m-%d_%H-%M-%S', '%Y%m%d_%H%M%S_person')
+SPLIT_GAP = 60  # Seconds dropped after the calibration block (same scene, see SnapshotIndex)
+
+
+def letterbox(image, size=IMG_SIZE):
+    """Resize giu ti le + pad 114 (giong tien xu ly cua ultralytics), tra ve NCHW float32"""
+    h, w = image.shape[:2]
+    scale = min(size / h, size / w)
+    new_w, new_h = int(round(w * scale)), int(round(h * scale))
+    resized = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    
+    canvas = np.full((size, size, 3), 114, dtype=np.uint8)
+    top, left = (size - new_h) // 2, (size - new_w) // 2
+    canvas[top:top + new_h, left:left + new_w] = resized
+    
+    rgb = cv2.cvtColor(canvas, cv2.COLOR_BGR2RGB)
+    return np.ascontiguousarray(rgb.transpose(2, 0, 1)[None], dtype=np.float32) / 255.0
+
+
+def snapshot_time(path):
+    """Thoi diem chup cua snapshot: doc tu ten file, neu khong duoc thi dung mtime"""
+    name = os.path.splitext(os.path.basename(path))[0]
+    for fmt in SNAPSHOT_NAME_FORMATS:
+        try:
+            return datetime.strptime(name, fmt)
+        except ValueError:
+            continue
+    return datetime.fromtimestamp(os.path.getmtime(path))
+
+
+def load_images(image_dir=IMAGE_DIR, max_images=200):
+    """
+    Doc max_images anh snapshot (png/jpg) moi nhat, chia theo khoi thoi gian
+    
+    Nua cu hon dung de calibration, nua moi hon dung de evaluation (bo cac
+    anh trong SPLIT_GAP giay sau anh calibration cuoi). Snapshot lien tiep
+    gan nhu giong nhau, nen chia xen ke se dua cung mot canh vao ca hai tap
+    va lam accuracy gate de dang hon thuc te.
+    
+    Returns:
+        tuple: (calibration_images, eval_images, split_info)
+    """
+    paths = glob.glob(os.path.join(image_dir, '*.png')) + glob.glob(os.path.join(image_dir, '*.jpg'))
+    timed = sorted((snapshot_time(p), p) for p in paths)[-max_images:]
+    loaded = [(t, img) for t, img in ((t, cv2.imread(p)) for t, p in timed) if img is not None]
+    if len(loaded) < 2:
+        raise RuntimeError(f"Can it nhat 2 anh trong {image_dir}")
+    
+    half = len(loaded) // 2
+    calibration = loaded[:half]
+    cutoff = calibration[-1][0] + timedelta(seconds=SPLIT_GAP)
+    evaluation = [(t, img) for t, img in loaded[half:] if t > cutoff]
+    if not evaluation:
+        raise RuntimeError(f"Khong con anh evaluation sau {SPLIT_GAP}s ke tu anh calibration cuoi")
+    
+    split_info = {
+        "split": "time_block",
+        "split_gap_seconds": SPLIT_GAP,
+        "calibration_until": calibration[-1][0].strftime("%d/%m/%Y %H:%M:%S"),
+        "evaluation_from": evaluation[0][0].strftime("%d/%m/%Y %H:%M:%S")
+    }
+    return [img for _, img in calibration], [img for _, img in evaluation], split_info
+
+
+class SnapshotCalibrationReader:
+    """CalibrationDataReader cho onnxruntime.quantization.quantize_static"""
+    
+    def __init__(self, images, input_name):
+        self.input_name = input_name
+        self.iterator = iter(images)
+    
+    def get_next(self):
+        image = next(self.iterator, None)
+        if image is None:
+            return None
+        return {self.input_name: letterbox(image)}
+
+
+def export_onnx(model_path):
+    """Export FP32 .pt sang ONNX (dung ultralytics)"""
+    from ultralytics import YOLO
+    
+    onnx_path = YOLO(model_path).export(format='onnx', imgsz=IMG_SIZE, dynamic=False, simplify=True)
+    print(f"[Quant] Da export ONNX FP32: {onnx_path}")
+    return str(onnx_path)
+
+
+def quantize(fp32_onnx, output_path, mode, calibration_images):
+    """
+    Luong hoa model ONNX
+    
+    Args:
+        mode: 'dynamic' (INT8 weights), 'static' (INT8 weights + activations,
+              calibration bang snapshot) hoac 'fp16'
+    """
+    if mode == 'fp16':
+        import onnx
+        from onnxconverter_common import float16
+        
+        model = onnx.load(fp32_onnx)
+        onnx.save(float16.convert_float_to_float16(model, keep_io_types=True), output_path)
+    elif mode == 'dynamic':
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        
+        quantize_dynamic(fp32_onnx, output_path, weight_type=QuantType.QUInt8)
+    elif mode == 'static':
+        import onnxruntime as ort
+        from onnxruntime.quantization import QuantFormat, QuantType, quantize_static
+        
+        input_name = ort.InferenceSession(fp32_onnx, providers=['CPUExecutionProvider']).get_inputs()[0].name
+        quantize_static(
+            fp32_onnx, output_path,
+            SnapshotCalibrationReader(calibration_images, input_name),
+            quant_format=QuantFormat.QDQ,
+            per_channel=True,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8
+        )
+    else:
+        raise ValueError(f"Unknown mode: {mode}")
+    
+    print(f"[Quant] Da luong hoa ({mode}): {output_path}")
+    return output_path
+
+
+def person_boxes(model, image, threshold=CONFIDENCE_THRESHOLD):
+    """Tra ve list box [x1, y1, x2, y2] cua nguoi co conf >= threshold"""
+    boxes = []
+    for result in model(image, verbose=False):
+        for box in result.boxes:
+            if int(box.cls[0]) == PERSON_CLASS_ID and float(box.conf[0]) >= threshold:
+                boxes.append([float(v) for v in box.xyxy[0]])
+    return boxes
+
+
+def iou(a, b):
+    """Intersection over union cua 2 box xyxy"""
+    ix1, iy1 = max(a[0], b[0]), max(a[1], b[1])
+    ix2, iy2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, ix2 - ix1) * max(0.0, iy2 - iy1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def count_matches(reference, candidate):
+    """Ghep box greedy theo IoU, tra ve so box reference duoc tim thay"""
+    unused = list(candidate)
+    matched = 0
+    for ref in reference:
+        best = max(unused, key=lambda c: iou(ref, c), default=None)
+        if best is not None and iou(ref, best) >= IOU_MATCH:
+            unused.remove(best)
+            matched += 1
+    return matched
+
+
+def evaluate(fp32_model_path, quant_model_path, images):
+    """
+    So sanh model luong hoa voi FP32 tren anh evaluation
+    
+    Returns:
+        dict: recall (so voi FP32), count_agreement, latency va speedup
+    """
+    from ultralytics import YOLO
+    
+    fp32 = YOLO(fp32_model_path)
+    quant = YOLO(quant_model_path, task='detect')
+    
+    # Warm-up (first call includes session setup)
+    fp32(images[0], verbose=False)
+    quant(images[0], verbose=False)
+    
+    reference_total = matched_total = agree = 0
+    fp32_time = quant_time = 0.0
+    for image in images:
+        start = time.perf_counter()
+        reference = person_boxes(fp32, image)
+        fp32_time += time.perf_counter() - start
+        
+        start = time.perf_counter()
+        candidate = person_boxes(quant, image)
+        quant_time += time.perf_counter() - start
+        
+        reference_total += len(reference)
+        matched_total += count_matches(reference, candidate)
+        agree += int(len(reference) == len(candidate))
+    
+    fp32_ms = fp32_time / len(images) * 1000
+    quant_ms = quant_time / len(images) * 1000
+    return {
+        "images": len(images),
+        "reference_persons": reference_total,
+        "recall": matched_total / reference_total if reference_total else 1.0,
+        "count_agreement": agree / len(images),
+        "fp32_ms": round(fp32_ms, 2),
+        "quantized_ms": round(quant_ms, 2),
+        "speedup": round(fp32_ms / quant_ms, 2) if quant_ms else 0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Quantize YOLO11n with an accuracy gate")
+    parser.add_argument('--model', default=os.path.join(MODEL_DIR, 'yolo11n.pt'), help="FP32 .pt model")
+    parser.add_argument('--mode', choices=['static', 'dynamic', 'fp16'], default='static')
+    parser.add_argument('--images', default=IMAGE_DIR, help="Calibration/evaluation images")
+    parser.add_argument('--max-images', type=int, default=200)
+    parser.add_argument('--tolerance', type=float, default=0.02,
+                        help="Max allowed person recall drop vs FP32 (0.02 = 2%%)")
+    parser.add_argument('--min-reference', type=int, default=10,
+                        help="Min persons FP32 must find in evaluation images for the gate to count")
+    args = parser.parse_args()
+    
+    calibration_images, eval_images, split_info = load_images(args.images, args.max_images)
+    print(f"[Quant] Calibration: {len(calibration_images)} anh (den {split_info['calibration_until']}), "
+          f"Evaluation: {len(eval_images)} anh (tu {split_info['evaluation_from']})")
+    
+    fp32_onnx = export_onnx(args.model)
+    candidate_path = os.path.splitext(fp32_onnx)[0] + f'_{args.mode}.onnx'
+    quantize(fp32_onnx, candidate_path, args.mode, calibration_images)
+    
+    report = evaluate(args.model, candidate_path, eval_images)
+    report.update(split_info)
+    report.update({
+        "mode": args.mode,
+        "tolerance": args.tolerance,
+        "confidence_threshold": CONFIDENCE_THRESHOLD,
+        "source_model": os.path.basename(args.model),
+        "created": datetime.now().strftime("%d/%m/%Y %H:%M:%S")
+    })
+    print(f"[Quant] Recall: {report['recall']:.3f} | Count agreement: {report['count_agreement']:.3f}")
+    print(f"[Quant] FP32: {report['fp32_ms']} ms | {args.mode}: {report['quantized_ms']} ms "
+          f"| Speedup: {report['speedup']}x")
+    
+    # Accuracy gate - recall over too few persons proves nothing
+    if report['reference_persons'] < args.min_reference:
+        print(f"[Quant] TU CHOI deploy: FP32 chi tim thay {report['reference_persons']} nguoi "
+              f"(can >= {args.min_reference}) - khong du du lieu de kiem tra do chinh xac")
+        return 1
+    if report['recall'] < 1.0 - args.tolerance:
+        print(f"[Quant] TU CHOI deploy: recall giam {1.0 - report['recall']:.3f} > tolerance {args.tolerance}")
+        return 1
+    
+    os.makedirs(MODEL_DIR, exist_ok=True)
+    shutil.copyfile(candidate_path, QUANTIZED_MODEL_PATH)
+    with open(QUANTIZED_REPORT_PATH, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"[Quant] Da deploy: {QUANTIZED_MODEL_PATH}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,148 @@
+"""
+Telemetry Module
+Log tom tat tung frame dang binary co dinh do dai (NumPy structured array)
+Moi ngay mot file, doc lai bang np.memmap - khong can SQL/pandas
+"""
+import os
+import glob
+from datetime import datetime, timedelta
+
+import numpy as np
+
+
+# One record per frame (packed, 19 bytes) - never reorder fields, only append new
+# ones together with a new FILE_PREFIX so old files stay readable
+FRAME_DTYPE = np.dtype([
+    ('ts', '<f8'),              # Capture time (epoch seconds)
+    ('person_count', '<u2'),
+    ('gate_state', 'u1'),       # 0 = CLOSED, 1 = OPEN
+    ('max_confidence', '<f4'),
+    ('latency_ms', '<f4'),      # Capture -> frame fully processed
+])
+
+FILE_PREFIX = "frames_v1_"
+DEFAULT_LOG_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'database', 'telemetry'))
+GATE_CLOSED = 0
+GATE_OPEN = 1
+
+
+class FrameTelemetry:
+    """
+    Append-only writer cho telemetry tung frame
+    
+    Ghi vao buffer NumPy co san, moi FLUSH_EVERY frame ghi mot lan ra
+    file (mot lenh write) -> chi phi moi frame rat nho.
+    """
+    
+    FLUSH_EVERY = 30  # ~1 giay o 30 FPS
+    
+    def __init__(self, log_dir=None, flush_every=None):
+        """Initialize telemetry writer"""
+        self.log_dir = os.path.abspath(log_dir or DEFAULT_LOG_DIR)
+        os.makedirs(self.log_dir, exist_ok=True)
+        
+        if flush_every is not None:
+            self.FLUSH_EVERY = flush_every
+        self.buffer = np.zeros(self.FLUSH_EVERY, dtype=FRAME_DTYPE)
+        self.count = 0
+        
+        self.file = None
+        self.day_end = 0.0  # Epoch when the current file must rotate
+    
+    def _open_file(self, ts):
+        """Mo file cua ngay chua `ts` (append)"""
+        if self.file:
+            self.file.close()
+        day = datetime.fromtimestamp(ts)
+        start = day.replace(hour=0, minute=0, second=0, microsecond=0)
+        self.day_end = (start + timedelta(days=1)).timestamp()
+        path = os.path.join(self.log_dir, f"{FILE_PREFIX}{day.strftime('%Y%m%d')}.bin")
+        
+        # Drop a torn trailing record (crash mid-write) so new records stay aligned
+        if os.path.exists(path):
+            size = os.path.getsize(path)
+            if size % FRAME_DTYPE.itemsize:
+                os.truncate(path, size - size % FRAME_DTYPE.itemsize)
+                print(f"[Telemetry] Da cat ban ghi do: {os.path.basename(path)}")
+        self.file = open(path, 'ab')
+    
+    def append(self, ts, person_count, max_confidence, gate_open, latency_ms):
+        """Them mot frame vao log"""
+        if ts >= self.day_end:
+            self.flush()
+            self._open_file(ts)
+        
+        self.buffer[self.count] = (ts, person_count, GATE_OPEN if gate_open else GATE_CLOSED,
+                                   max_confidence, latency_ms)
+        self.count += 1
+        if self.count == self.FLUSH_EVERY:
+            self.flush()
+    
+    def flush(self):
+        """Ghi cac frame trong buffer ra file"""
+        if self.count and self.file:
+            self.file.write(self.buffer[:self.count].tobytes())
+            self.file.flush()
+        self.count = 0
+    
+    def close(self):
+        """Flush va dong file"""
+        self.flush()
+        if self.file:
+            self.file.close()
+            self.file = None
+            self.day_end = 0.0
+        print("[Telemetry] Da dong log")
+
+
+def list_files(log_dir=None):
+    """Danh sach file telemetry, sap xep theo ngay"""
+    log_dir = os.path.abspath(log_dir or DEFAULT_LOG_DIR)
+    return sorted(glob.glob(os.path.join(log_dir, f"{FILE_PREFIX}*.bin")))
+
+
+def read_frames(path):
+    """
+    Doc mot file telemetry bang np.memmap (khong copy vao RAM)
+    
+    Ban ghi cuoi bi ghi do (crash giua chung) duoc bo qua; writer cat
+    phan do nay truoc khi ghi tiep nen cac ban ghi sau van thang hang.
+    
+    Returns:
+        np.memmap: Structured array voi dtype FRAME_DTYPE
+    """
+    count = os.path.getsize(path) // FRAME_DTYPE.itemsize
+    if count == 0:
+        return np.zeros(0, dtype=FRAME_DTYPE)
+    return np.memmap(path, dtype=FRAME_DTYPE, mode='r', shape=(count,))
+
+
+def read_day(day=None, log_dir=None):
+    """Doc telemetry cua mot ngay (datetime/date, mac dinh: hom nay)"""
+    day = day or datetime.now()
+    log_dir = os.path.abspath(log_dir or DEFAULT_LOG_DIR)
+    path = os.path.join(log_dir, f"{FILE_PREFIX}{day.strftime('%Y%m%d')}.bin")
+    if not os.path.exists(path):
+        return np.zeros(0, dtype=FRAME_DTYPE)
+    return read_frames(path)
+
+
+if __name__ == "__main__":
+    # Tom tat telemetry
+    files = list_files()
+    print(f"Telemetry files: {len(files)}")
+    
+    for path in files:
+        frames = read_frames(path)
+        if len(frames) == 0:
+            continue
+        occupied = frames['person_count'] > 0
+        span = frames['ts'][-1] - frames['ts'][0]
+        print(f"\n[{os.path.basename(path)}]")
+        print(f"  - Frames: {len(frames)} ({len(frames) / span:.1f} FPS)" if span > 0 else f"  - Frames: {len(frames)}")
+        print(f"  - Latency TB / p95: {frames['latency_ms'].mean():.1f} / "
+              f"{np.percentile(frames['latency_ms'], 95):.1f} ms")
+        print(f"  - Co nguoi: {occupied.mean() * 100:.1f}% frame")
+        print(f"  - Cong OPEN: {(frames['gate_state'] == GATE_OPEN).mean() * 100:.1f}% frame")
+        if occupied.any():
+            print(f"  - Confidence TB (co nguoi): {frames['max_confidence'][occupied].mean():.2f}")